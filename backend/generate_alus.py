@@ -1,13 +1,26 @@
 import os
 import json
-import uuid
+import functools
 import random
+import time
 import datetime
 import boto3
 import re
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from decimal import Decimal
 
+try:
+    import orjson  # not in the base Lambda runtime; ship it in a layer for the fast path
+except ImportError:
+    orjson = None
+
+try:
+    from json_repair import repair_json  # optional; local fallback below covers the common slips
+except ImportError:
+    repair_json = None
+
 # ─────────────────────────────────────────────────────────────
 # Config
 # ─────────────────────────────────────────────────────────────
@@ -19,13 +32,42 @@ MAX_IMAGES = int(os.environ.get("MAX_IMAGES", "3"))
 ALU_MIN = int(os.environ.get("ALU_MIN", "8"))
 ALU_MAX = int(os.environ.get("ALU_MAX", "15"))
 
+# Mark the static PASS 2 instructions with cache_control. Opt-in: models/regions without
+# Bedrock prompt caching reject the block (invoke_claude then drops it and retries)
+PROMPT_CACHING = os.environ.get("PROMPT_CACHING", "false").lower() == "true"
+
 GENERATE_IMAGE_FN = os.environ.get("GENERATE_IMAGE_FN", "generate_image")
 
-ddb = boto3.resource("dynamodb", region_name=AWS_REGION)
+# Output budget per generated item (JSON incl. keys); first attempts are sized from target_n
+PER_CONCEPT_TOKENS = 90
+PER_CARD_TOKENS = 260
+PASS1_MAX_TOKENS = 2600
+PASS2_MAX_TOKENS = 4200
+# Hard ceiling for the doubled retry after a max_tokens truncation (model output limit)
+MAX_OUTPUT_TOKENS = int(os.environ.get("MAX_OUTPUT_TOKENS", "8192"))
+
+BATCH_WRITE_SIZE = 25  # DynamoDB BatchWriteItem hard limit
+BATCH_WRITE_RETRIES = 5
+
+# Built once per container: keep-alive sockets + a pool big enough for the parallel fan-outs
+_CFG = Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "max_attempts": 3},
+    connect_timeout=1.0,
+    read_timeout=30,
+)
+# Long PASS 2 generations can run well past 30s
+_BEDROCK_CFG = _CFG.merge(Config(read_timeout=120))
+
+ddb = boto3.resource("dynamodb", region_name=AWS_REGION, config=_CFG)
 table = ddb.Table(TABLE_NAME)
 
-brt = boto3.client("bedrock-runtime", region_name=AWS_REGION)
-lambda_client = boto3.client("lambda", region_name=AWS_REGION)
+brt = boto3.client("bedrock-runtime", region_name=AWS_REGION, config=_BEDROCK_CFG)
+lambda_client = boto3.client("lambda", region_name=AWS_REGION, config=_CFG)
+
+# Shared pool for overlapping DynamoDB round-trips (lives for the warm container)
+_POOL = ThreadPoolExecutor(max_workers=4)
 
 # ─────────────────────────────────────────────────────────────
 # Guardrails (Structured prompt + Text density)
@@ -54,10 +96,17 @@ POSTER_KEYWORDS = [
     "thumbnail", "cover", "title card", "logo", "branding"
 ]
 
+# Whole words (plus a plural "s"), so "ad" doesn't fire on "head" / "read" but "posters" still counts
+POSTER_RE = re.compile(r"\b(?:" + "|".join(re.escape(k) for k in POSTER_KEYWORDS) + r")s?\b")
+TEXT_IN_IMAGE_RE = re.compile(r"(Text in image:\s*).*$", re.MULTILINE)
+
+CODE_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+TRAILING_COMMA_RE = re.compile(r",\s*([\]}])")
+
 
 def wants_text_in_image(raw_text: str, title: str) -> bool:
     t = f"{title or ''} {raw_text or ''}".lower()
-    return any(k in t for k in POSTER_KEYWORDS)
+    return bool(POSTER_RE.search(t))
 
 
 def validate_structured_prompt(p: str) -> bool:
@@ -76,33 +125,24 @@ def normalize_labels(labels):
     if not labels:
         return []
 
-    labels = [str(x).strip() for x in labels if str(x).strip()]
-    labels = labels[:3]
-
-    cleaned = []
-    for lab in labels:
-        words = lab.split()
-        cleaned.append(" ".join(words[:2]))
-
-    all_words = " ".join(cleaned).split()
-    if len(all_words) > 8:
-        all_words = all_words[:8]
-        rebuilt = []
-        i = 0
-        while i < len(all_words) and len(rebuilt) < 3:
-            rebuilt.append(" ".join(all_words[i:i+2]))
-            i += 2
-        cleaned = rebuilt
-
+    # At most 3 labels x 2 words, so the 8-word total can't be exceeded
     out = []
     seen = set()
-    for lab in cleaned:
-        lab = lab.strip()
-        if lab and lab.lower() not in seen:
+    taken = 0
+    for x in labels:
+        raw = str(x)
+        if not raw.strip():
+            continue
+        taken += 1
+        if taken > 3:
+            break
+        lab = " ".join(raw.split()[:2])
+        low = lab.lower()
+        if lab and low not in seen:
             out.append(lab)
-            seen.add(lab.lower())
+            seen.add(low)
 
-    return out[:3]
+    return out
 
 
 def build_structured_image_prompt(title: str, image_style: str, labels: list) -> str:
@@ -124,58 +164,65 @@ def build_structured_image_prompt(title: str, image_style: str, labels: list) ->
     )
 
 
-def enforce_image_prompt_guardrails(cards: list, allow_text: bool) -> list:
+def _fix_image_prompt(c: dict, allow_text: bool):
     """
-    Enforce BOTH:
+    Enforce BOTH on one image card:
     1) image_prompt structured format
     2) text density (labels) rules
     """
-    for c in cards:
-        if c.get("post_type") != "image":
-            continue
-
-        labels = c.get("image_labels") or []
-        if not allow_text:
-            labels = []
-        else:
-            labels = normalize_labels(labels)
-
-        c["image_labels"] = labels if labels else None
+    labels = c.get("image_labels") or []
+    if not allow_text:
+        labels = []
+    else:
+        labels = normalize_labels(labels)
 
-        ip = c.get("image_prompt") or ""
-        if not validate_structured_prompt(ip):
-            c["image_prompt"] = build_structured_image_prompt(
-                title=c.get("title", ""),
-                image_style=c.get("image_style"),
-                labels=labels
-            )
-            continue
+    c["image_labels"] = labels if labels else None
 
-        desired_text = "None" if not labels else " | ".join(labels)
-        ip = re.sub(r"(Text in image:\s*).*$", r"\1" + desired_text, ip, flags=re.MULTILINE)
+    ip = c.get("image_prompt") or ""
+    if not validate_structured_prompt(ip):
+        c["image_prompt"] = build_structured_image_prompt(
+            title=c.get("title", ""),
+            image_style=c.get("image_style"),
+            labels=labels
+        )
+        return
 
-        if "Text must occupy less than 20% of the frame" not in ip:
-            ip = ip.rstrip() + f"\nQuality modifiers: High resolution, sharp focus, no watermark, no logo, {VISUAL_BALANCE_RULES}\n"
+    desired_text = "None" if not labels else " | ".join(labels)
+    ip = TEXT_IN_IMAGE_RE.sub(lambda m: m.group(1) + desired_text, ip)
 
-        c["image_prompt"] = ip
+    if "Text must occupy less than 20% of the frame" not in ip:
+        ip = ip.rstrip() + f"\nQuality modifiers: High resolution, sharp focus, no watermark, no logo, {VISUAL_BALANCE_RULES}\n"
 
-    return cards
+    c["image_prompt"] = ip
 
 
 # ─────────────────────────────────────────────────────────────
 # NEW Guardrail: Image hooks must be STATEMENTS (no questions)
 # ─────────────────────────────────────────────────────────────
-def _title_case_statement(s: str) -> str:
-    s = (s or "").strip()
-    if not s:
-        return s
-    # Light normalization: remove trailing punctuation
-    s = s.rstrip("?.! ")
-    # Capitalize first character, keep rest as-is
-    return s[0].upper() + s[1:]
+IMAGE_HOOK_FALLBACK = "Key idea explained"
+Q_STARTERS = frozenset(("why", "how", "what", "when", "where", "is", "are", "can", "do", "does", "did", "should", "could", "would"))
+HOOK_MAX_WORDS = 12
 
 
-def enforce_image_hook_statement(cards: list) -> list:
+def _statement_words(words: list) -> list:
+    """
+    Light normalization on an already-split hook: drop trailing punctuation,
+    truncate to HOOK_MAX_WORDS, capitalize the first character.
+    """
+    while words:
+        last = words[-1].rstrip("?.! ")
+        if last:
+            words[-1] = last
+            break
+        words.pop()
+
+    words = words[:HOOK_MAX_WORDS]
+    if words:
+        words[0] = words[0][0].upper() + words[0][1:]
+    return words
+
+
+def _fix_hook(c: dict):
     """
     For post_type=image:
     - hook must NOT be a question
@@ -183,43 +230,21 @@ def enforce_image_hook_statement(cards: list) -> list:
     Strategy:
     - If hook contains '?', convert into a statement.
     - Also strip leading question starters like Why/How/What/When/Where/Is/Are/Can/Do/Does.
-    - If hook is empty or still bad, fallback to: "The difference between X and Y" style from title.
+    - If hook is empty or still bad, fallback to the title.
     """
-    q_starters = ("why", "how", "what", "when", "where", "is", "are", "can", "do", "does", "did", "should", "could", "would")
-
-    for c in cards:
-        if c.get("post_type") != "image":
-            continue
-
-        hook = (c.get("hook") or "").strip()
-        title = (c.get("title") or "").strip()
-
-        # If hook is empty, make one from title
-        if not hook:
-            hook = title or "Key idea explained"
-
-        # Remove question mark & common question phrasing
-        hook = hook.replace("?", "").strip()
+    title = (c.get("title") or "").strip()
 
-        # Remove leading question starter word if present
-        parts = hook.split()
-        if parts and parts[0].lower() in q_starters:
-            hook = " ".join(parts[1:]).strip()
+    # If hook is empty, make one from title; then remove question marks & a leading question starter word
+    words = ((c.get("hook") or "").strip() or title or IMAGE_HOOK_FALLBACK).replace("?", "").split()
+    if words and words[0].lower() in Q_STARTERS:
+        words = words[1:]
+    words = _statement_words(words)
 
-        # If it became empty after stripping
-        if not hook:
-            hook = title or "Key idea explained"
+    # If it became empty after stripping
+    if not words:
+        words = _statement_words((title or IMAGE_HOOK_FALLBACK).split())
 
-        hook = _title_case_statement(hook)
-
-        # Enforce <= 12 words (truncate safely)
-        words = hook.split()
-        if len(words) > 12:
-            hook = " ".join(words[:12])
-
-        c["hook"] = hook
-
-    return cards
+    c["hook"] = " ".join(words) if words else IMAGE_HOOK_FALLBACK
 
 
 # ─────────────────────────────────────────────────────────────
@@ -231,6 +256,29 @@ def json_default(o):
     raise TypeError(f"Type not serializable: {type(o)}")
 
 
+# Prebuilt stdlib encoder for the no-orjson path: compact separators, UTF-8 kept as is
+_ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=json_default).encode
+
+
+def dumps_bytes(obj, indent: bool = False) -> bytes:
+    if orjson is not None:
+        opt = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, default=json_default, option=opt)
+    if indent:
+        return json.dumps(obj, default=json_default, ensure_ascii=False, indent=2).encode("utf-8")
+    return _ENCODER(obj).encode("utf-8")
+
+
+def loads(data):
+    """
+    Accepts str or bytes. orjson.JSONDecodeError subclasses json.JSONDecodeError,
+    so callers catch the stdlib type either way.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 def resp(code, body):
     return {
         "statusCode": code,
@@ -240,42 +288,161 @@ def resp(code, body):
             "Access-Control-Allow-Headers": "content-type",
             "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
         },
-        "body": json.dumps(body, default=json_default),
+        "body": dumps_bytes(body).decode("utf-8"),
     }
 
 
+def new_ids(n: int) -> list:
+    """
+    n random 12-hex-char ids (48 random bits each, same as uuid4().hex[:12])
+    from a single urandom read instead of one per id.
+    """
+    raw = os.urandom(6 * n)
+    return [raw[i:i + 6].hex() for i in range(0, 6 * n, 6)]
+
+
 def now_iso():
-    return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+# Constant envelope of the Bedrock messages body; only the numbers and prompt text vary per call
+_BODY_PREFIX = b'{"anthropic_version":"bedrock-2023-05-31","max_tokens":'
+_BODY_MESSAGES = b',"messages":[{"role":"user","content":['
+_BODY_SUFFIX = b'}]}]}'
+
+
+# Cleared for the rest of the container once Bedrock rejects a cache_control block
+_prompt_caching = PROMPT_CACHING
+# Likewise once the model or role turns out not to support response streaming
+_streaming = True
+
+
+@functools.lru_cache(maxsize=8)
+def _prefix_block(text: str, cache: bool) -> bytes:
+    """
+    Serialized content block for a static prompt prefix (one per PASS2_HEADER variant).
+    """
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = {"type": "ephemeral"}
+    return dumps_bytes(block) + b","
 
 
-def invoke_claude(prompt: str, max_tokens: int = 3000, temperature: float = 0.35) -> str:
+def _claude_body(prompt: str, max_tokens: int, temperature: float, cached_prefix: str = None) -> bytes:
+    return b"".join((
+        _BODY_PREFIX, str(int(max_tokens)).encode(),
+        b',"temperature":', repr(float(temperature)).encode(),
+        _BODY_MESSAGES,
+        _prefix_block(cached_prefix, _prompt_caching) if cached_prefix else b"",
+        b'{"type":"text","text":', dumps_bytes(prompt),
+        _BODY_SUFFIX,
+    ))
+
+
+def invoke_claude(prompt: str, max_tokens: int = 3000, temperature: float = 0.35, cached_prefix: str = None) -> tuple:
+    """
+    Returns (text, stop_reason) so callers can tell truncation ("max_tokens") from bad JSON.
+    cached_prefix: static instructions sent as a leading content block,
+    marked for Bedrock prompt caching when PROMPT_CACHING is on.
+    """
     if not MODEL_ID:
         raise ValueError("MODEL_ID env var missing")
 
-    body = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": max_tokens,
-        "temperature": temperature,
-        "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}],
-    }
+    global _prompt_caching
+    payload = _claude_body(prompt, max_tokens, temperature, cached_prefix)
 
     try:
-        r = brt.invoke_model(
-            modelId=MODEL_ID,
-            body=json.dumps(body).encode("utf-8"),
-            contentType="application/json",
-            accept="application/json",
-        )
-        raw = r["body"].read().decode("utf-8")
-        data = json.loads(raw)
-        return "".join([c.get("text", "") for c in data.get("content", [])])
+        return _invoke_body(payload)
+    except ClientError as e:
+        if not (cached_prefix and _prompt_caching and e.response.get("Error", {}).get("Code") == "ValidationException"):
+            raise RuntimeError(f"Bedrock invoke failed: {e}")
+        # Most likely this model/region has no prompt caching: drop cache_control and retry once
+        print(f"Bedrock rejected the cache_control body ({e}); retrying without prompt caching")
+        _prompt_caching = False
+
+    try:
+        return _invoke_body(_claude_body(prompt, max_tokens, temperature, cached_prefix))
     except ClientError as e:
         raise RuntimeError(f"Bedrock invoke failed: {e}")
 
 
-def parse_json(text: str):
+def _invoke_body(payload: bytes) -> tuple:
     """
-    Best-effort JSON extraction (array or object), with repair fallback.
+    Streaming invoke, falling back to a plain invoke for models / roles without streaming.
+    Only errors about streaming itself fall back; anything else (a bad body, throttling)
+    would fail the plain invoke the same way, so it is raised as is.
+    """
+    global _streaming
+    if _streaming:
+        try:
+            r = brt.invoke_model_with_response_stream(
+                modelId=MODEL_ID,
+                body=payload,
+                contentType="application/json",
+                accept="application/json",
+            )
+            return _read_stream(r["body"])
+        except ClientError as e:
+            err = e.response.get("Error", {})
+            code = err.get("Code")
+            about_streaming = code == "AccessDeniedException" or (
+                code == "ValidationException" and "stream" in (err.get("Message") or "").lower()
+            )
+            if not about_streaming:
+                raise
+            print(f"Bedrock streaming unavailable ({e}); using invoke_model for this container")
+            _streaming = False
+
+    r = brt.invoke_model(
+        modelId=MODEL_ID,
+        body=payload,
+        contentType="application/json",
+        accept="application/json",
+    )
+    data = loads(r["body"].read())
+    return "".join([c.get("text", "") for c in data.get("content", [])]), data.get("stop_reason")
+
+
+def _read_stream(stream) -> tuple:
+    """
+    Accumulate text deltas from an Anthropic messages stream as they arrive.
+    Mid-stream errors surface from botocore as EventStreamError (a ClientError).
+    """
+    parts = []
+    stop_reason = None
+    for event in stream:
+        chunk = event.get("chunk")
+        if not chunk:
+            continue
+        data = loads(chunk["bytes"])
+        kind = data.get("type")
+        if kind == "content_block_delta":
+            parts.append(data.get("delta", {}).get("text", ""))
+        elif kind == "message_delta":
+            stop_reason = data.get("delta", {}).get("stop_reason") or stop_reason
+    return "".join(parts), stop_reason
+
+
+def invoke_claude_complete(prompt: str, max_tokens: int = 3000, temperature: float = 0.35, cached_prefix: str = None) -> str:
+    """
+    invoke_claude() for JSON callers: a response cut off at max_tokens is re-run
+    once with double the budget instead of going to JSON repair, which can't
+    recover cards that were never generated.
+    """
+    text, stop_reason = invoke_claude(prompt, max_tokens, temperature, cached_prefix)
+    if stop_reason == "max_tokens" and max_tokens < MAX_OUTPUT_TOKENS:
+        print(f"Claude output truncated at max_tokens={max_tokens}; retrying with a larger budget")
+        text, _ = invoke_claude(prompt, min(max_tokens * 2, MAX_OUTPUT_TOKENS), temperature, cached_prefix)
+    return text
+
+
+def invoke_claude_future(pool, prompt: str, max_tokens: int = 3000, temperature: float = 0.35, cached_prefix: str = None):
+    return pool.submit(invoke_claude_complete, prompt, max_tokens, temperature, cached_prefix)
+
+
+def _extract_json(text: str):
+    """
+    Slice out the outermost array (or object) and parse it. Returns None if neither parses.
     """
     text = (text or "").strip()
 
@@ -283,7 +450,7 @@ def parse_json(text: str):
     e = text.rfind("]")
     if s != -1 and e > s:
         try:
-            return json.loads(text[s:e + 1])
+            return loads(text[s:e + 1])
         except json.JSONDecodeError:
             pass
 
@@ -291,35 +458,99 @@ def parse_json(text: str):
     e = text.rfind("}")
     if s != -1 and e > s:
         try:
-            return json.loads(text[s:e + 1])
+            return loads(text[s:e + 1])
         except json.JSONDecodeError:
             pass
 
+    return None
+
+
+def _repair_json_locally(text: str):
+    """
+    Fix the usual Claude slips (markdown fences, trailing commas, quoting)
+    without another Bedrock round-trip. Returns None if that isn't enough.
+    """
+    text = (text or "").strip()
+    m = CODE_FENCE_RE.search(text)
+    if m:
+        text = m.group(1)
+
+    if repair_json is not None:
+        try:
+            fixed = repair_json(text, return_objects=True)
+            if fixed and isinstance(fixed, (list, dict)):
+                return fixed
+        except Exception:
+            pass
+
+    return _extract_json(TRAILING_COMMA_RE.sub(r"\1", text))
+
+
+def parse_json(text: str, retry_prompt: str = None, retry_max_tokens: int = 3000, retry_prefix: str = None):
+    """
+    Best-effort JSON extraction (array or object), with repair fallback.
+    Local repair is tried first. Only if that fails do the repair prompt and
+    (if given) a fresh run of the original prompt race each other; whichever
+    yields valid JSON first wins.
+    """
+    parsed = _extract_json(text)
+    if parsed is None:
+        parsed = _repair_json_locally(text)
+    if parsed is not None:
+        return parsed
+
     fix_prompt = (
         "Fix the following into STRICTLY VALID JSON. "
         "Return ONLY the corrected JSON. No markdown. No commentary.\n\n"
-        f"{text}"
+        f"{(text or '').strip()}"
     )
-    fixed = invoke_claude(fix_prompt, max_tokens=2500, temperature=0.1).strip()
-    s = fixed.find("[") if "[" in fixed else fixed.find("{")
-    e = fixed.rfind("]") if "]" in fixed else fixed.rfind("}")
-    if s != -1 and e > s:
-        return json.loads(fixed[s:e + 1])
+    # Own short-lived executor: the losing call can't be cancelled once running, and on
+    # _POOL it would hold a worker the DynamoDB writes (and the next invocation) need
+    race = ThreadPoolExecutor(max_workers=2)
+    try:
+        pending = {invoke_claude_future(race, fix_prompt, max_tokens=2500, temperature=0.1)}
+        if retry_prompt:
+            pending.add(invoke_claude_future(race, retry_prompt, max_tokens=retry_max_tokens, cached_prefix=retry_prefix))
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                try:
+                    parsed = _extract_json(f.result())
+                except Exception as e:
+                    print(f"JSON repair attempt failed: {e}")
+                    continue
+                if parsed is not None:
+                    return parsed
+    finally:
+        race.shutdown(wait=False)
 
     raise ValueError("Could not parse model output as JSON")
 
 
+def _keyword_re(words: list):
+    return re.compile("|".join(re.escape(w) for w in words))
+
+
+# First match wins, so order matters (same precedence as before)
+ICON_RULES = [
+    (_keyword_re(["heart", "cardio", "cholesterol", "blood pressure", "fitness", "exercise", "workout", "gym"]), "❤️"),
+    (_keyword_re(["diet", "food", "nutrition", "recipe", "protein", "calories"]), "🥗"),
+    (_keyword_re(["code", "python", "react", "sql", "javascript", "software"]), "💻"),
+    (_keyword_re(["math", "algebra", "statistics", "probability"]), "📐"),
+    (_keyword_re(["science", "physics", "chemistry", "biology"]), "🔬"),
+    (_keyword_re(["business", "marketing", "finance", "economy", "money", "budget"]), "📈"),
+    (_keyword_re(["psychology", "brain", "mind", "habits"]), "🧠"),
+    (_keyword_re(["aws", "cloud", "devops", "lambda", "dynamodb"]), "☁️"),
+    (_keyword_re(["machine learning", "ai", "neural", "llm"]), "🤖"),
+]
+
+
 def pick_icon(text: str) -> str:
     t = (text or "").lower()
-    if any(w in t for w in ["heart", "cardio", "cholesterol", "blood pressure", "fitness", "exercise", "workout", "gym"]): return "❤️"
-    if any(w in t for w in ["diet", "food", "nutrition", "recipe", "protein", "calories"]): return "🥗"
-    if any(w in t for w in ["code", "python", "react", "sql", "javascript", "software"]): return "💻"
-    if any(w in t for w in ["math", "algebra", "statistics", "probability"]): return "📐"
-    if any(w in t for w in ["science", "physics", "chemistry", "biology"]): return "🔬"
-    if any(w in t for w in ["business", "marketing", "finance", "economy", "money", "budget"]): return "📈"
-    if any(w in t for w in ["psychology", "brain", "mind", "habits"]): return "🧠"
-    if any(w in t for w in ["aws", "cloud", "devops", "lambda", "dynamodb"]): return "☁️"
-    if any(w in t for w in ["machine learning", "ai", "neural", "llm"]): return "🤖"
+    for rx, icon in ICON_RULES:
+        if rx.search(t):
+            return icon
     return "📚"
 
 
@@ -375,17 +606,21 @@ CONTENT:
 \"\"\"{raw_text[:12000]}\"\"\"
 """.strip()
 
-    out = invoke_claude(prompt, max_tokens=2600, temperature=0.35)
-    concepts = parse_json(out)
+    max_tokens = min(PASS1_MAX_TOKENS, int(target_n * PER_CONCEPT_TOKENS * 1.3) + 200)
+    out = invoke_claude_complete(prompt, max_tokens=max_tokens, temperature=0.35)
+    # Retries get the full ceiling in case the sized budget was too tight
+    concepts = parse_json(out, retry_prompt=prompt, retry_max_tokens=PASS1_MAX_TOKENS)
 
     if not isinstance(concepts, list) or len(concepts) != target_n:
+        # concepts may come from the repair race's fresh run, not from `out`
+        draft = dumps_bytes(concepts).decode("utf-8") if isinstance(concepts, list) else out
         fix_prompt = f"""Fix to a JSON array of EXACTLY {target_n} items with the same schema.
 Return ONLY JSON array.
 
 DRAFT:
-{json.dumps(concepts)}
+{draft}
 """
-        concepts = parse_json(invoke_claude(fix_prompt, max_tokens=2200, temperature=0.2))
+        concepts = parse_json(invoke_claude_complete(fix_prompt, max_tokens=2200, temperature=0.2))
 
     if not isinstance(concepts, list) or len(concepts) != target_n:
         raise ValueError(f"Concept extraction returned {len(concepts) if isinstance(concepts, list) else 'non-list'}; expected {target_n}")
@@ -398,17 +633,21 @@ DRAFT:
 # ─────────────────────────────────────────────────────────────
 # PASS 2 — Cards (adds structured image_prompt + statement hooks)
 # ─────────────────────────────────────────────────────────────
-def pass2_design_cards(concepts: list, target_n: int, topic_hint: str, allow_text: bool) -> list:
-    concepts_json = json.dumps(concepts, indent=2)
-
-    text_policy = (
+def _pass2_text_policy(allow_text: bool) -> str:
+    return (
         "Text in image is allowed ONLY if truly necessary (poster/quote/ad intent)."
         if allow_text else
         "Text in image MUST be None (no text)."
     )
 
-    prompt = f"""
-Return STRICT JSON array of EXACTLY {target_n} cards. No markdown. No extra text.
+
+def _build_pass2_header(allow_text: bool) -> str:
+    """
+    Everything in the PASS 2 prompt that doesn't depend on the request.
+    Kept as a stable prefix so Bedrock prompt caching can reuse it.
+    """
+    return f"""
+Return STRICT JSON array with EXACTLY the number of cards given in CARD COUNT. No markdown. No extra text.
 First character MUST be [ and last MUST be ].
 
 Allowed post_type: image | flashcard | quiz
@@ -445,7 +684,7 @@ HARD IMAGE RULES:
 - Prefer: humans in action, characters, realistic objects, lifestyle scenes, before/after contrasts.
 - Only use anatomical diagrams if absolutely required.
 
-{text_policy}
+{_pass2_text_policy(allow_text)}
 
 TEXT DENSITY RULES (STRICT):
 - Default: Text in image: None
@@ -484,6 +723,19 @@ image_style, image_labels, image_prompt,
 takeaways, mastery_question.
 
 UNUSED FIELDS must be null (example: if not image => image_prompt/image_style/image_labels null).
+""".strip()
+
+
+# Both variants built once at import; keyed by allow_text
+PASS2_HEADER = {flag: _build_pass2_header(flag) for flag in (True, False)}
+
+
+def pass2_design_cards(concepts: list, target_n: int, topic_hint: str, allow_text: bool) -> list:
+    concepts_json = dumps_bytes(concepts, indent=True).decode("utf-8")
+    header = PASS2_HEADER[allow_text]
+
+    prompt = f"""
+CARD COUNT: EXACTLY {target_n} cards.
 
 TOPIC HINT:
 {topic_hint}
@@ -492,8 +744,9 @@ CONCEPTS (1 concept => 1 card, same order):
 {concepts_json}
 """.strip()
 
-    out = invoke_claude(prompt, max_tokens=4200, temperature=0.35)
-    cards = parse_json(out)
+    max_tokens = min(PASS2_MAX_TOKENS, int(target_n * PER_CARD_TOKENS * 1.3) + 400)
+    out = invoke_claude_complete(prompt, max_tokens=max_tokens, temperature=0.35, cached_prefix=header)
+    cards = parse_json(out, retry_prompt=prompt, retry_max_tokens=PASS2_MAX_TOKENS, retry_prefix=header)
 
     if not isinstance(cards, list) or len(cards) != target_n:
         fix_prompt = f"""Fix to EXACTLY {target_n} cards. Keep schema and all rules. Return ONLY JSON array.
@@ -502,12 +755,12 @@ TOPIC HINT:
 {topic_hint}
 
 CONCEPTS:
-{json.dumps(concepts)}
+{concepts_json}
 
 DRAFT:
-{json.dumps(cards)}
+{dumps_bytes(cards).decode("utf-8")}
 """
-        cards = parse_json(invoke_claude(fix_prompt, max_tokens=4200, temperature=0.25))
+        cards = parse_json(invoke_claude_complete(fix_prompt, max_tokens=PASS2_MAX_TOKENS, temperature=0.25, cached_prefix=header))
 
     if not isinstance(cards, list) or len(cards) != target_n:
         raise ValueError(f"Cards returned {len(cards) if isinstance(cards, list) else 'non-list'}; expected {target_n}")
@@ -518,81 +771,109 @@ DRAFT:
 # ─────────────────────────────────────────────────────────────
 # Enforcement
 # ─────────────────────────────────────────────────────────────
-def enforce_constraints(cards: list) -> list:
-    # Cap images
+def _to_flashcard(c: dict, default_title: str, default_answer: str):
+    c["post_type"] = "flashcard"
+    c["image_prompt"] = None
+    c["image_style"] = None
+    c["image_labels"] = None
+    title = c.get("title", default_title)
+    me = c.get("micro_explanation", [])
+    ans = me[0] if isinstance(me, list) and me else default_answer
+    c["flashcard"] = {f"What is {title}?": str(ans)[:200]}
+    c["quiz"] = None
+
+
+def _to_quiz(c: dict):
+    c["post_type"] = "quiz"
+    c["quiz"] = {
+        "question": c.get("mastery_question") or f"What is important about {c.get('title','this concept')}?",
+        "choices": ["Option A", "Option B", "Option C", "Option D"],
+        "answer_index": 0,
+        "explanation": "Choose the best answer based on the concept."
+    }
+    c["flashcard"] = None
+    c["image_prompt"] = None
+    c["image_style"] = None
+    c["image_labels"] = None
+
+
+def _to_image(c: dict):
+    c["post_type"] = "image"
+    c["image_style"] = "cinematic"
+    c["image_labels"] = None
+    c["image_prompt"] = build_structured_image_prompt(
+        title=c.get("title", ""),
+        image_style=c.get("image_style"),
+        labels=[]
+    )
+    c["flashcard"] = None
+    c["quiz"] = None
+
+
+def _convert_first(cards: list, counts: dict, src: str, to):
+    for c in cards:
+        if c.get("post_type") == src:
+            to(c)
+            counts[src] -= 1
+            counts[c["post_type"]] = counts.get(c["post_type"], 0) + 1
+            return
+
+
+def finalize_cards(cards: list, allow_text: bool, user_id: str, node_id: str, ts: str):
+    """
+    Apply every card rule and emit the DynamoDB items + image jobs in one traversal.
+    A cheap tally pass (which also caps images) runs first, because the
+    quiz/image/flashcard backfill can change a card's type before its
+    guardrails apply; the backfill itself only runs when a type is missing.
+    Returns (items, image_jobs).
+    """
+    # Cap images + tally types
+    counts = {}
     img_count = 0
     for c in cards:
-        if c.get("post_type") == "image":
+        pt = c.get("post_type")
+        if pt == "image":
             img_count += 1
             if img_count > MAX_IMAGES:
-                c["post_type"] = "flashcard"
-                c["image_prompt"] = None
-                c["image_style"] = None
-                c["image_labels"] = None
-                title = c.get("title", "Key concept")
-                me = c.get("micro_explanation", [])
-                ans = me[0] if isinstance(me, list) and me else "See explanation."
-                c["flashcard"] = {f"What is {title}?": str(ans)[:200]}
-                c["quiz"] = None
-
-    def has(t):
-        return any(x.get("post_type") == t for x in cards)
+                _to_flashcard(c, "Key concept", "See explanation.")
+                pt = "flashcard"
+        counts[pt] = counts.get(pt, 0) + 1
 
     # Ensure quiz
-    if not has("quiz"):
+    if not counts.get("quiz"):
         c = cards[-1]
-        c["post_type"] = "quiz"
-        c["quiz"] = {
-            "question": c.get("mastery_question") or f"What is important about {c.get('title','this concept')}?",
-            "choices": ["Option A", "Option B", "Option C", "Option D"],
-            "answer_index": 0,
-            "explanation": "Choose the best answer based on the concept."
-        }
-        c["flashcard"] = None
-        c["image_prompt"] = None
-        c["image_style"] = None
-        c["image_labels"] = None
+        counts[c.get("post_type")] -= 1
+        _to_quiz(c)
+        counts["quiz"] = 1
 
     # Ensure image
-    if not has("image"):
-        for c in cards:
-            if c.get("post_type") == "flashcard":
-                c["post_type"] = "image"
-                c["image_style"] = "cinematic"
-                c["image_labels"] = None
-                c["image_prompt"] = build_structured_image_prompt(
-                    title=c.get("title", ""),
-                    image_style=c.get("image_style"),
-                    labels=[]
-                )
-                c["flashcard"] = None
-                c["quiz"] = None
-                break
+    if not counts.get("image"):
+        _convert_first(cards, counts, "flashcard", _to_image)
 
     # Ensure flashcard
-    if not has("flashcard"):
-        for c in cards:
-            if c.get("post_type") == "image":
-                c["post_type"] = "flashcard"
-                title = c.get("title", "Key idea")
-                me = c.get("micro_explanation", [])
-                ans = me[0] if isinstance(me, list) and me else "Short, clear answer."
-                c["flashcard"] = {f"What is {title}?": str(ans)[:200]}
-                c["image_prompt"] = None
-                c["image_style"] = None
-                c["image_labels"] = None
-                c["quiz"] = None
-                break
-
-    # Strict nulling
-    for c in cards:
-        if c.get("post_type") != "image":
+    if not counts.get("flashcard"):
+        _convert_first(cards, counts, "image", lambda c: _to_flashcard(c, "Key idea", "Short, clear answer."))
+
+    items = []
+    image_jobs = []
+    pk = f"USER#{user_id}"
+    sk_prefix = f"ALU#{node_id}#"
+    alu_ids = new_ids(len(cards))
+
+    for i, c in enumerate(cards):
+        pt = c.get("post_type")
+
+        # Strict nulling + guardrails
+        if pt == "image":
+            _fix_image_prompt(c, allow_text)
+            _fix_hook(c)  # statement hooks for image posts
+        else:
             c["image_prompt"] = None
             c["image_style"] = None
             c["image_labels"] = None
-        if c.get("post_type") != "flashcard":
+        if pt != "flashcard":
             c["flashcard"] = None
-        if c.get("post_type") != "quiz":
+        if pt != "quiz":
             c["quiz"] = None
 
         c.setdefault("hook", "")
@@ -603,19 +884,97 @@ def enforce_constraints(cards: list) -> list:
         c.setdefault("visual_type", "diagram")
         c.setdefault("visual_payload", {})
 
-    return cards
+        alu_id = alu_ids[i]
+
+        items.append({
+            "PK": pk,
+            "SK": sk_prefix + alu_id,
+            "entity_type": "ALU",
+            "user_id": user_id,
+            "node_id": node_id,
+            "alu_id": alu_id,
+            "order": i + 1,
+            "title": c["title"],
+            "hook": c["hook"],
+            "post_type": c.get("post_type", "flashcard"),
+            "micro_explanation": c["micro_explanation"],
+            "flashcard": c.get("flashcard"),
+            "quiz": c.get("quiz"),
+            "visual_type": c["visual_type"],
+            "visual_payload": c["visual_payload"],
+            "image_style": c.get("image_style"),
+            "image_labels": c.get("image_labels"),
+            "image_prompt": c.get("image_prompt"),
+            "image_s3_key": None,
+            "takeaways": c["takeaways"],
+            "mastery_question": c["mastery_question"],
+            "created_at": ts,
+        })
+
+        if pt == "image" and c.get("image_prompt"):
+            image_jobs.append({"user_id": user_id, "node_id": node_id, "alu_id": alu_id})
+
+    return items, image_jobs
+
+
+def _batch_write_chunk(requests: list):
+    """
+    One BatchWriteItem call, retrying UnprocessedItems with exponential backoff.
+    Goes through the resource's client so native Python types are still serialized for us.
+    """
+    pending = {TABLE_NAME: requests}
+    for attempt in range(BATCH_WRITE_RETRIES):
+        r = table.meta.client.batch_write_item(RequestItems=pending)
+        pending = r.get("UnprocessedItems") or {}
+        if not pending:
+            return
+        time.sleep(min(0.05 * (2 ** attempt), 1.0))
+    raise RuntimeError(f"BatchWriteItem left {len(pending.get(TABLE_NAME, []))} unprocessed items")
+
+
+def write_items_async(items: list) -> list:
+    """
+    Shard items into 25-item BatchWriteItem calls and submit them in parallel.
+    """
+    requests = [{"PutRequest": {"Item": it}} for it in items]
+    return [
+        _POOL.submit(_batch_write_chunk, requests[i:i + BATCH_WRITE_SIZE])
+        for i in range(0, len(requests), BATCH_WRITE_SIZE)
+    ]
+
+
+def bump_topics_rev(pk):
+    """
+    Bump the user's META topics_rev so get_feed's cached topic list is refreshed.
+    Best effort: a missed bump only leaves that cache stale until its TTL runs out.
+    """
+    try:
+        table.update_item(
+            Key={"PK": pk, "SK": "META"},
+            UpdateExpression="ADD topics_rev :one",
+            ExpressionAttributeValues={":one": 1},
+        )
+    except Exception as e:
+        print(f"topics_rev bump failed for {pk}: {e}")
+
+
+def _invoke_image(job: dict):
+    try:
+        lambda_client.invoke(
+            FunctionName=GENERATE_IMAGE_FN,
+            InvocationType="Event",
+            Payload=dumps_bytes(job),
+        )
+    except Exception as e:
+        print(f"Async image invoke failed for alu_id={job.get('alu_id')}: {e}")
 
 
 def invoke_images_async(image_jobs: list):
-    for job in image_jobs:
-        try:
-            lambda_client.invoke(
-                FunctionName=GENERATE_IMAGE_FN,
-                InvocationType="Event",
-                Payload=json.dumps(job).encode("utf-8"),
-            )
-        except Exception as e:
-            print(f"Async image invoke failed for alu_id={job.get('alu_id')}: {e}")
+    if not image_jobs:
+        return
+    # Event invokes are independent; fire them together so fan-out costs ~one RTT
+    with ThreadPoolExecutor(max_workers=min(len(image_jobs), 8)) as ex:
+        list(ex.map(_invoke_image, image_jobs))
 
 
 # ─────────────────────────────────────────────────────────────
@@ -627,11 +986,12 @@ def lambda_handler(event, context):
 
     user_id = None
     node_id = None
+    inflight = []  # pool futures that must settle before the error-status write
 
     try:
         body = event.get("body") or "{}"
         if isinstance(body, str):
-            body = json.loads(body)
+            body = loads(body)
 
         user_id = body.get("user_id")
         raw_text = (body.get("raw_text") or "").strip()
@@ -642,7 +1002,7 @@ def lambda_handler(event, context):
         if not raw_text:
             return resp(400, {"error": "raw_text required"})
 
-        node_id = body.get("node_id") or uuid.uuid4().hex[:12]
+        node_id = body.get("node_id") or new_ids(1)[0]
 
         if not title:
             title = raw_text.split("\n")[0].strip()
@@ -651,10 +1011,14 @@ def lambda_handler(event, context):
 
         raw_text = raw_text[:12000]
         ts = now_iso()
-
-        table.put_item(Item={
-            "PK": f"USER#{user_id}",
-            "SK": f"TOPIC#{node_id}",
+        pk = f"USER#{user_id}"
+        topic_sk = f"TOPIC#{node_id}"
+        icon = pick_icon(title or raw_text)
+
+        # Topic placeholder write overlaps with PASS 1 (Bedrock dominates wall time)
+        topic_put = _POOL.submit(table.put_item, Item={
+            "PK": pk,
+            "SK": topic_sk,
             "entity_type": "Topic",
             "user_id": user_id,
             "node_id": node_id,
@@ -662,10 +1026,11 @@ def lambda_handler(event, context):
             "status": "generating",
             "card_count": 0,
             "learnt_count": 0,
-            "icon": pick_icon(title or raw_text),
+            "icon": icon,
             "created_at": ts,
             "updated_at": ts,
         })
+        inflight.append(topic_put)
 
         target_n = choose_target_count(raw_text)
 
@@ -678,70 +1043,44 @@ def lambda_handler(event, context):
         allow_text = wants_text_in_image(raw_text, title)
 
         concepts = pass1_extract_concepts(raw_text, target_n)
+        topic_put.result()
+        inflight.append(_POOL.submit(bump_topics_rev, pk))
         cards = pass2_design_cards(concepts, target_n, topic_hint=topic_hint, allow_text=allow_text)
 
-        cards = enforce_constraints(cards)
-        cards = enforce_image_prompt_guardrails(cards, allow_text)
-        cards = enforce_image_hook_statement(cards)  # NEW: statement hooks for image posts
-
-        items = []
-        image_jobs = []
-
-        for i, card in enumerate(cards):
-            alu_id = uuid.uuid4().hex[:12]
-            order = i + 1
-
-            items.append({
-                "PK": f"USER#{user_id}",
-                "SK": f"ALU#{node_id}#{alu_id}",
-                "entity_type": "ALU",
-                "user_id": user_id,
-                "node_id": node_id,
-                "alu_id": alu_id,
-                "order": order,
-                "title": card.get("title", ""),
-                "hook": card.get("hook", ""),
-                "post_type": card.get("post_type", "flashcard"),
-                "micro_explanation": card.get("micro_explanation", []),
-                "flashcard": card.get("flashcard"),
-                "quiz": card.get("quiz"),
-                "visual_type": card.get("visual_type", "diagram"),
-                "visual_payload": card.get("visual_payload", {}),
-                "image_style": card.get("image_style"),
-                "image_labels": card.get("image_labels"),
-                "image_prompt": card.get("image_prompt"),
-                "image_s3_key": None,
-                "takeaways": card.get("takeaways", []),
-                "mastery_question": card.get("mastery_question", ""),
-                "created_at": ts,
-            })
-
-            if card.get("post_type") == "image" and card.get("image_prompt"):
-                image_jobs.append({"user_id": user_id, "node_id": node_id, "alu_id": alu_id})
-
-        with table.batch_writer() as batch:
-            for it in items:
-                batch.put_item(Item=it)
+        items, image_jobs = finalize_cards(cards, allow_text, user_id, node_id, ts)
 
-        table.update_item(
-            Key={"PK": f"USER#{user_id}", "SK": f"TOPIC#{node_id}"},
-            UpdateExpression="SET #s = :s, card_count = :c, updated_at = :u",
+        writes = write_items_async(items)
+        status_update = _POOL.submit(
+            table.update_item,
+            Key={"PK": pk, "SK": topic_sk},
+            # generate_image counts pending_images down and flips the topic to ready at zero
+            UpdateExpression="SET #s = :s, card_count = :c, pending_images = :p, updated_at = :u",
             ExpressionAttributeNames={"#s": "status"},
             ExpressionAttributeValues={
                 ":s": "images_pending" if image_jobs else "ready",
                 ":c": len(items),
+                ":p": len(image_jobs),
                 ":u": now_iso(),
             },
         )
+        inflight += writes + [status_update]
+
+        # generate_image reads the card rows and decrements the topic counter,
+        # so both must land before the fan-out
+        for f in writes + [status_update]:
+            f.result()
+        inflight.append(_POOL.submit(bump_topics_rev, pk))
 
-        if image_jobs:
-            invoke_images_async(image_jobs)
+        # Has to finish before we return, since Lambda freezes the sandbox
+        # (and any background thread) after the response
+        invoke_images_async(image_jobs)
+        wait(inflight)
 
         return resp(200, {
             "status": "ok",
             "node_id": node_id,
             "title": title,
-            "icon": pick_icon(title or raw_text),
+            "icon": icon,
             "created": len(items),
             "images_pending": len(image_jobs),
             "card_summary": {
@@ -754,6 +1093,7 @@ def lambda_handler(event, context):
 
     except Exception as e:
         try:
+            wait(inflight)  # don't let the error status race an earlier write
             if user_id and node_id:
                 table.update_item(
                     Key={"PK": f"USER#{user_id}", "SK": f"TOPIC#{node_id}"},
@@ -761,6 +1101,7 @@ def lambda_handler(event, context):
                     ExpressionAttributeNames={"#s": "status"},
                     ExpressionAttributeValues={":s": "error", ":u": now_iso()},
                 )
+                bump_topics_rev(f"USER#{user_id}")
         except Exception:
             pass
         return resp(500, {"error": str(e)})
\ No newline at end of file
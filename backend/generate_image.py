@@ -1,19 +1,49 @@
 import os
 import json
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import base64
 import time
-import urllib.request
-import urllib.error
+import functools
+import urllib3
 from boto3.dynamodb.conditions import Key
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 TABLE_NAME = os.environ.get("TABLE_NAME", "LoopMind")
+AWS_REGION = os.environ.get("AWS_REGION", "us-east-2")
 BUCKET = os.environ.get("IMAGE_BUCKET")
 API_KEY = os.environ.get("GEMINI_API_KEY")
 
-ddb = boto3.resource("dynamodb")
+_CFG = Config(tcp_keepalive=True, max_pool_connections=50, retries={"mode": "standard", "max_attempts": 3})
+
+ddb = boto3.resource("dynamodb", region_name=AWS_REGION, config=_CFG)
 table = ddb.Table(TABLE_NAME)
-s3 = boto3.client("s3")
+
+# Keeps the TLS session to Gemini alive across warm invocations.
+# 502/503 get one immediate retry; 429 is handled with a backoff in call_gemini_image.
+_HTTP = urllib3.PoolManager(
+    num_pools=1,
+    maxsize=4,
+    retries=urllib3.Retry(total=1, status_forcelist=[502, 503], allowed_methods=None, raise_on_status=False),
+)
+
+_s3 = None
+
+
+def _get_s3():
+    """
+    S3 client built on first use: the skip / already-has-image paths never touch S3.
+    """
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client("s3", region_name=AWS_REGION, config=_CFG)
+    return _s3
+
 
 VISUAL_BALANCE_RULES = (
     "Text must occupy less than 20% of the frame. "
@@ -37,6 +67,9 @@ HOUSE_STYLE_PREFIX = (
 )
 
 
+_ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
 def resp(code, body):
     return {
         "statusCode": code,
@@ -46,7 +79,10 @@ def resp(code, body):
             "Access-Control-Allow-Headers": "content-type",
             "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
         },
-        "body": json.dumps(body),
+        "body": (
+            orjson.dumps(body, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+            if orjson is not None else _ENCODER(body)
+        ),
     }
 
 
@@ -75,33 +111,52 @@ def normalize_labels(labels):
     if not labels:
         return []
 
-    labels = [str(x).replace("?", "").strip() for x in labels if str(x).strip()]
-    labels = labels[:3]
-
-    cleaned = []
-    for lab in labels:
-        words = lab.split()
-        cleaned.append(" ".join(words[:2]))
-
-    all_words = " ".join(cleaned).split()
-    if len(all_words) > 8:
-        all_words = all_words[:8]
-        rebuilt = []
-        i = 0
-        while i < len(all_words) and len(rebuilt) < 3:
-            rebuilt.append(" ".join(all_words[i:i+2]))
-            i += 2
-        cleaned = rebuilt
-
+    # At most 3 labels x 2 words, so the 8-word total can't be exceeded
     out = []
     seen = set()
-    for lab in cleaned:
-        lab = lab.strip()
-        if lab and lab.lower() not in seen:
+    taken = 0
+    for x in labels:
+        raw = str(x)
+        if not raw.strip():
+            continue
+        taken += 1
+        if taken > 3:
+            break
+        lab = " ".join(raw.replace("?", "").split()[:2])
+        low = lab.lower()
+        if lab and low not in seen:
             out.append(lab)
-            seen.add(lab.lower())
+            seen.add(low)
+
+    return out
 
-    return out[:3]
+
+@functools.lru_cache(maxsize=256)
+def _style_and_text_rule(style, labels):
+    """
+    The (style, labels)-only part of the prompt; image_prompt is unique per ALU,
+    so only this prefix is worth memoizing.
+    """
+    style_hint = STYLE_MAP.get(style, STYLE_MAP["cinematic"])
+
+    allowed = " | ".join(normalize_labels(labels))
+
+    text_rule = (
+        f"Text allowed ONLY using these exact labels: [{allowed}]. No other text. {VISUAL_BALANCE_RULES}"
+        if allowed else
+        f"Use no text. {VISUAL_BALANCE_RULES}"
+    )
+
+    return (
+        f"{HOUSE_STYLE_PREFIX}"
+        f"Style: {style_hint}. "
+        f"{text_rule}\n\n"
+    )
+
+
+def _build_prompt(style, labels, image_prompt):
+    # Pass structured prompt directly; do not weaken structure with "Scene:"
+    return f"{_style_and_text_rule(style, labels)}{image_prompt}\n"
 
 
 def call_gemini_image(prompt: str) -> dict:
@@ -114,23 +169,66 @@ def call_gemini_image(prompt: str) -> dict:
         },
     }
 
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(payload).encode("utf-8"),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
+    data = json.dumps(payload).encode("utf-8")
 
+    def post():
+        return _HTTP.request(
+            "POST",
+            url,
+            body=data,
+            headers={"Content-Type": "application/json"},
+            timeout=25,
+        )
+
+    r = post()
+    if r.status == 429:
+        time.sleep(3)
+        r = post()
+    if r.status >= 300:
+        raise RuntimeError(f"Gemini HTTPError {r.status}: {r.data.decode('utf-8', errors='replace')}")
+    # ~4 MB of base64 in the body; orjson parses it several times faster
+    return orjson.loads(r.data) if orjson is not None else json.loads(r.data)
+
+
+def bump_topics_rev(pk):
+    """
+    Bump the user's META topics_rev so get_feed's cached topic list is refreshed.
+    Best effort: a missed bump only leaves that cache stale until its TTL runs out.
+    """
+    try:
+        table.update_item(
+            Key={"PK": pk, "SK": "META"},
+            UpdateExpression="ADD topics_rev :one",
+            ExpressionAttributeValues={":one": 1},
+        )
+    except Exception as e:
+        print(f"topics_rev bump failed for {pk}: {e}")
+
+
+def count_down_pending(pk, node_id):
+    """
+    Atomically decrement the topic's pending_images; True once it reaches zero.
+    Topics created before the counter existed fall back to checking every ALU.
+    """
     try:
-        with urllib.request.urlopen(req, timeout=25) as r:
-            return json.loads(r.read().decode("utf-8"))
-    except urllib.error.HTTPError as e:
-        body = e.read().decode("utf-8", errors="replace")
-        if e.code == 429:
-            time.sleep(3)
-            with urllib.request.urlopen(req, timeout=25) as r2:
-                return json.loads(r2.read().decode("utf-8"))
-        raise RuntimeError(f"Gemini HTTPError {e.code}: {body}")
+        r = table.update_item(
+            Key={"PK": pk, "SK": f"TOPIC#{node_id}"},
+            UpdateExpression="ADD pending_images :neg",
+            ConditionExpression="attribute_exists(pending_images)",
+            ExpressionAttributeValues={":neg": -1},
+            ReturnValues="UPDATED_NEW",
+        )
+        return r["Attributes"]["pending_images"] <= 0
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+
+    all_alus = table.query(
+        KeyConditionExpression=Key("PK").eq(pk) & Key("SK").begins_with(f"ALU#{node_id}#"),
+        ConsistentRead=True,
+    )
+    image_alus = [a for a in all_alus["Items"] if a.get("post_type") == "image"]
+    return all(a.get("image_s3_key") for a in image_alus)
 
 
 def lambda_handler(event, context):
@@ -174,51 +272,41 @@ def lambda_handler(event, context):
             return resp(400, {"error": "image_prompt missing on image post"})
 
         style = (item.get("image_style") or "cinematic").strip().lower()
-        style_hint = STYLE_MAP.get(style, STYLE_MAP["cinematic"])
-
-        labels = normalize_labels(item.get("image_labels") or [])
-        allowed = " | ".join(labels)
-
-        text_rule = (
-            f"Text allowed ONLY using these exact labels: [{allowed}]. No other text. {VISUAL_BALANCE_RULES}"
-            if allowed else
-            f"Use no text. {VISUAL_BALANCE_RULES}"
-        )
-
-        # Pass structured prompt directly; do not weaken structure with "Scene:"
-        final_prompt = (
-            f"{HOUSE_STYLE_PREFIX}"
-            f"Style: {style_hint}. "
-            f"{text_rule}\n\n"
-            f"{image_prompt}\n"
-        )
+        final_prompt = _build_prompt(style, tuple(item.get("image_labels") or ()), image_prompt)
 
         data = call_gemini_image(final_prompt)
         img_b64 = extract_image_b64(data)
         img_bytes = base64.b64decode(img_b64)
+        # Drop the ~4 MB base64 text (and the response dict holding it) before the upload
+        del data, img_b64
 
         s3_key = f"users/{user_id}/{node_id}/{alu_id}.png"
-        s3.put_object(Bucket=BUCKET, Key=s3_key, Body=img_bytes, ContentType="image/png")
+        _get_s3().put_object(Bucket=BUCKET, Key=s3_key, Body=img_bytes, ContentType="image/png")
 
-        table.update_item(
-            Key={"PK": pk, "SK": sk},
-            UpdateExpression="SET image_s3_key = :k",
-            ExpressionAttributeValues={":k": s3_key},
-        )
+        # Stamp exactly once, so a duplicate/retried invocation can't count the topic down twice
+        try:
+            table.update_item(
+                Key={"PK": pk, "SK": sk},
+                UpdateExpression="SET image_s3_key = :k",
+                # generate_alus writes the key as an explicit NULL placeholder
+                ConditionExpression="attribute_not_exists(image_s3_key) OR attribute_type(image_s3_key, :null)",
+                ExpressionAttributeValues={":k": s3_key, ":null": "NULL"},
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return resp(200, {"status": "ok", "reason": "already has image", "stored": s3_key})
 
-        all_alus = table.query(
-            KeyConditionExpression=Key("PK").eq(f"USER#{user_id}") & Key("SK").begins_with(f"ALU#{node_id}#"),
-        )
-        image_alus = [a for a in all_alus["Items"] if a.get("post_type") == "image"]
-        all_done = all(a.get("image_s3_key") for a in image_alus)
+        all_done = count_down_pending(pk, node_id)
 
         if all_done:
             table.update_item(
-                Key={"PK": f"USER#{user_id}", "SK": f"TOPIC#{node_id}"},
+                Key={"PK": pk, "SK": f"TOPIC#{node_id}"},
                 UpdateExpression="SET #s = :s",
                 ExpressionAttributeNames={"#s": "status"},
                 ExpressionAttributeValues={":s": "ready"},
             )
+            bump_topics_rev(pk)
 
         return resp(200, {"status": "ok", "stored": s3_key, "topic_ready": bool(all_done)})
 
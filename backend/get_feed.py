@@ -1,16 +1,86 @@
 import os
 import json
+import time
+import hmac
+import hashlib
+import functools
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from botocore.config import Config
 from decimal import Decimal
 from boto3.dynamodb.conditions import Key
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 TABLE_NAME = os.environ.get("TABLE_NAME", "LoopMind")
 BUCKET = os.environ.get("IMAGE_BUCKET")
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-2")
+# Optional public/CloudFront origin for the image bucket; when set, no URL signing at all
+IMAGE_CDN_BASE = os.environ.get("IMAGE_CDN_BASE", "").rstrip("/")
+
+URL_TTL = 3600
+# Signatures are reused for half their lifetime, so every URL we hand out has >= 30 min left
+URL_REUSE_WINDOW = URL_TTL // 2
+
+# MODE 1 topic lists cached per warm container, keyed by user and checked against the
+# user's META topics_rev (bumped by every topic writer); the TTL bounds any missed bump
+TOPIC_CACHE_TTL = 30
+_TOPIC_CACHE = {}  # user_id -> (topics_rev, body, etag, monotonic ts)
+_TOPIC_CACHE_MAX = 512
+
+# Bucket and region are fixed per function, so the URL prefix and signature scope are too.
+# Dotted bucket names break the virtual-host TLS cert, so they go path-style.
+if BUCKET and "." not in BUCKET:
+    _S3_HOST, _S3_PATH = f"{BUCKET}.s3.{AWS_REGION}.amazonaws.com", ""
+else:
+    _S3_HOST, _S3_PATH = f"s3.{AWS_REGION}.amazonaws.com", f"/{BUCKET}"
 
-ddb = boto3.resource("dynamodb", region_name=AWS_REGION)
+_CFG = Config(tcp_keepalive=True, max_pool_connections=50, retries={"mode": "standard", "max_attempts": 3})
+
+ddb = boto3.resource("dynamodb", region_name=AWS_REGION, config=_CFG)
 table = ddb.Table(TABLE_NAME)
-s3 = boto3.client("s3", region_name=AWS_REGION)
+
+_PK, _SK = Key("PK"), Key("SK")
+
+_local = threading.local()
+
+
+def _init_worker():
+    # A resource's client shares one expression builder across calls, so concurrent
+    # Key(...) queries on `table` can garble each other; each worker gets its own
+    _local.table = boto3.session.Session().resource("dynamodb", region_name=AWS_REGION, config=_CFG).Table(TABLE_NAME)
+
+
+def _table():
+    return getattr(_local, "table", table)
+
+
+# MODE 2 reads are independent; run them side by side instead of back to back
+_POOL = ThreadPoolExecutor(max_workers=4, initializer=_init_worker)
+
+
+def _kc(pk, sk_prefix):
+    """
+    KeyConditionExpression for every item of one user whose SK starts with sk_prefix.
+    """
+    return _PK.eq(pk) & _SK.begins_with(sk_prefix)
+
+
+def query_all(**kwargs):
+    """
+    table.query that follows LastEvaluatedKey, yielding items page by page.
+    """
+    while True:
+        r = _table().query(**kwargs)
+        yield from r.get("Items", [])
+        if "LastEvaluatedKey" not in r:
+            return
+        kwargs["ExclusiveStartKey"] = r["LastEvaluatedKey"]
 
 
 def json_default(o):
@@ -19,19 +89,168 @@ def json_default(o):
     raise TypeError(f"Type not serializable: {type(o)}")
 
 
-def resp(code, body):
+@functools.lru_cache(maxsize=1)
+def _credentials():
+    return boto3.Session().get_credentials()
+
+
+@functools.lru_cache(maxsize=4)
+def _signing_key(secret, datestamp):
+    k = hmac.new(f"AWS4{secret}".encode("utf-8"), datestamp.encode("utf-8"), hashlib.sha256).digest()
+    for part in (AWS_REGION, "s3", "aws4_request"):
+        k = hmac.new(k, part.encode("utf-8"), hashlib.sha256).digest()
+    return k
+
+
+def presign_many(keys, now=None):
+    """
+    SigV4 query-string presign of GetObject for a batch of keys, same result as
+    s3.generate_presigned_url without botocore's per-call model / endpoint / handler
+    machinery. Timestamp, scope, credentials and the query string are shared by the
+    batch; each key only costs its canonical-request hash and one HMAC.
+    """
+    creds = _credentials().get_frozen_credentials()
+    amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(now))
+    scope = f"{amz_date[:8]}/{AWS_REGION}/s3/aws4_request"
+    signing_key = _signing_key(creds.secret_key, amz_date[:8])
+
+    params = [
+        ("X-Amz-Algorithm", "AWS4-HMAC-SHA256"),
+        ("X-Amz-Credential", f"{creds.access_key}/{scope}"),
+        ("X-Amz-Date", amz_date),
+        ("X-Amz-Expires", str(URL_TTL)),
+    ]
+    if creds.token:
+        params.append(("X-Amz-Security-Token", creds.token))
+    params.append(("X-Amz-SignedHeaders", "host"))
+    query = "&".join(f"{k}={urllib.parse.quote(v, safe='-_.~')}" for k, v in params)
+
+    request_tail = f"\n{query}\nhost:{_S3_HOST}\n\nhost\nUNSIGNED-PAYLOAD".encode("utf-8")
+    sign_head = f"AWS4-HMAC-SHA256\n{amz_date}\n{scope}\n".encode("utf-8")
+
+    urls = {}
+    for key in keys:
+        path = f"{_S3_PATH}/{urllib.parse.quote(key, safe='/-_.~')}"
+        digest = hashlib.sha256(b"GET\n" + path.encode("utf-8") + request_tail).hexdigest()
+        sig = hmac.new(signing_key, sign_head + digest.encode("ascii"), hashlib.sha256).hexdigest()
+        urls[key] = f"https://{_S3_HOST}{path}?{query}&X-Amz-Signature={sig}"
+    return urls
+
+
+# key -> (reuse window, url); reset wholesale when it grows past the cap
+_URL_CACHE = {}
+_URL_CACHE_MAX = 2048
+
+
+def image_urls(keys):
+    """
+    URLs for a set of image keys. Keys signed earlier in the current reuse window
+    come from the cache; the rest are signed together in one batch.
+    """
+    if IMAGE_CDN_BASE:
+        return {k: f"{IMAGE_CDN_BASE}/{urllib.parse.quote(k)}" for k in keys}
+
+    window = int(time.time() // URL_REUSE_WINDOW)
+    out, missing = {}, []
+    for k in keys:
+        hit = _URL_CACHE.get(k)
+        if hit and hit[0] == window:
+            out[k] = hit[1]
+        else:
+            missing.append(k)
+
+    if missing:
+        fresh = presign_many(missing)
+        if len(_URL_CACHE) + len(fresh) > _URL_CACHE_MAX:
+            _URL_CACHE.clear()
+        for k, url in fresh.items():
+            _URL_CACHE[k] = (window, url)
+        out.update(fresh)
+    return out
+
+
+_ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False, default=json_default).encode
+
+
+def dumps(body):
+    if orjson is not None:
+        return orjson.dumps(body, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return _ENCODER(body)
+
+
+def resp(code, body, headers=None):
+    """
+    body is a dict, or an already-serialized JSON string (cached topic list).
+    """
+    h = {
+        "Content-Type": "application/json",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Allow-Headers": "content-type,if-none-match",
+        "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
+    }
+    if headers:
+        h.update(headers)
     return {
         "statusCode": code,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "content-type",
-            "Access-Control-Allow-Methods": "OPTIONS,GET,POST",
-        },
-        "body": json.dumps(body, default=json_default),
+        "headers": h,
+        "body": body if isinstance(body, str) else dumps(body),
     }
 
 
+def request_header(event, name):
+    """
+    Case-insensitive header lookup (HTTP APIs lowercase names, REST APIs don't).
+    """
+    for k, v in (event.get("headers") or {}).items():
+        if k.lower() == name:
+            return v
+    return None
+
+
+def topic_list(user_id, pk):
+    """
+    (body, etag) for MODE 1, served from _TOPIC_CACHE while topics_rev is unchanged.
+    """
+    meta = table.get_item(
+        Key={"PK": pk, "SK": "META"},
+        ProjectionExpression="topics_rev",
+        ConsistentRead=True,
+    ).get("Item") or {}
+    rev = meta.get("topics_rev", 0)
+    now = time.monotonic()
+
+    hit = _TOPIC_CACHE.get(user_id)
+    if hit and hit[0] == rev and now - hit[3] < TOPIC_CACHE_TTL:
+        return hit[1], hit[2]
+
+    items = query_all(
+        KeyConditionExpression=_kc(pk, "TOPIC#"),
+        ProjectionExpression="node_id, title, icon, #s, card_count, learnt_count, created_at",
+        ExpressionAttributeNames={"#s": "status"},
+    )
+    topics = []
+    for it in items:
+        topics.append({
+            "node_id": it.get("node_id"),
+            "title": it.get("title", "Untitled"),
+            "icon": it.get("icon", "📚"),
+            "status": it.get("status", "ready"),
+            "card_count": it.get("card_count", 0),
+            "learnt_count": it.get("learnt_count", 0),
+            "created_at": it.get("created_at"),
+        })
+
+    topics.sort(key=lambda x: x.get("created_at") or "", reverse=True)
+    body = dumps({"topics": topics})
+    # Content hash, so the ETag matches across containers for the same list
+    etag = f'"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+
+    if len(_TOPIC_CACHE) >= _TOPIC_CACHE_MAX:
+        _TOPIC_CACHE.clear()
+    _TOPIC_CACHE[user_id] = (rev, body, etag, now)
+    return body, etag
+
+
 def lambda_handler(event, context):
     if event.get("requestContext", {}).get("http", {}).get("method") == "OPTIONS":
         return resp(200, {"ok": True})
@@ -51,50 +270,39 @@ def lambda_handler(event, context):
 
         # MODE 1: list topics
         if not node_id:
-            r = table.query(
-                KeyConditionExpression=(Key("PK").eq(pk) & Key("SK").begins_with("TOPIC#"))
-            )
-            topics = []
-            for it in r.get("Items", []):
-                topics.append({
-                    "node_id": it.get("node_id"),
-                    "title": it.get("title", "Untitled"),
-                    "icon": it.get("icon", "📚"),
-                    "status": it.get("status", "ready"),
-                    "card_count": it.get("card_count", 0),
-                    "learnt_count": it.get("learnt_count", 0),
-                    "created_at": it.get("created_at"),
-                })
-
-            topics.sort(key=lambda x: x.get("created_at") or "", reverse=True)
-            return resp(200, {"topics": topics})
+            body, etag = topic_list(user_id, pk)
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Access-Control-Expose-Headers": "ETag"}
+            if request_header(event, "if-none-match") == etag:
+                return resp(304, "", headers)
+            return resp(200, body, headers)
 
         # MODE 2: topic + cards
-        topic_item = table.get_item(Key={"PK": pk, "SK": f"TOPIC#{node_id}"}).get("Item", {})
-
-        r = table.query(
-            KeyConditionExpression=(Key("PK").eq(pk) & Key("SK").begins_with(f"ALU#{node_id}#"))
+        # Topic and ALU reads already overlap, so one combined request would not cut latency;
+        # TOPIC# and ALU# sort keys aren't adjacent either, so no single range query covers both
+        f_topic = _POOL.submit(
+            table.get_item,
+            Key={"PK": pk, "SK": f"TOPIC#{node_id}"},
+            ProjectionExpression="title, icon, #s, card_count, learnt_count",
+            ExpressionAttributeNames={"#s": "status"},
         )
-        alu_items = r.get("Items", [])
-
+        f_alus = _POOL.submit(lambda: list(query_all(KeyConditionExpression=_kc(pk, f"ALU#{node_id}#"))))
         # ✅ Efficient: only learnt for this node
-        learn_r = table.query(
-            KeyConditionExpression=(Key("PK").eq(pk) & Key("SK").begins_with(f"LEARN#{node_id}#"))
-        )
-        learnt_ids = set(it.get("alu_id") for it in learn_r.get("Items", []) if it.get("alu_id"))
-
-        cards = []
-        for it in alu_items:
-            img_url = None
-            key = it.get("image_s3_key")
-            if key:
-                img_url = s3.generate_presigned_url(
-                    "get_object",
-                    Params={"Bucket": BUCKET, "Key": key},
-                    ExpiresIn=3600,
-                )
-
-            cards.append({
+        f_learn = _POOL.submit(lambda: set(
+            it["alu_id"]
+            for it in query_all(KeyConditionExpression=_kc(pk, f"LEARN#{node_id}#"), ProjectionExpression="alu_id")
+            if it.get("alu_id")
+        ))
+
+        topic_item = f_topic.result().get("Item", {})
+        alu_items = f_alus.result()
+        learnt_ids = f_learn.result()
+
+        urls = image_urls({it["image_s3_key"] for it in alu_items if it.get("image_s3_key")})
+
+        # Sort the raw items once, then build the response cards already in order
+        alu_items.sort(key=lambda it: it.get("order") or 0)
+        cards = [
+            {
                 "alu_id": it.get("alu_id"),
                 "node_id": it.get("node_id"),
                 "order": it.get("order", 0),
@@ -104,15 +312,15 @@ def lambda_handler(event, context):
                 "micro_explanation": it.get("micro_explanation", []),
                 "flashcard": it.get("flashcard"),
                 "quiz": it.get("quiz"),
-                "image_url": img_url,
+                "image_url": urls.get(it.get("image_s3_key")),
                 "image_style": it.get("image_style"),
                 "takeaways": it.get("takeaways", []),
                 "mastery_question": it.get("mastery_question"),
                 "is_learnt": it.get("alu_id") in learnt_ids,
                 "created_at": it.get("created_at"),
-            })
-
-        cards.sort(key=lambda x: x.get("order") or 0)
+            }
+            for it in alu_items
+        ]
 
         return resp(200, {
             "topic": {
@@ -1,15 +1,30 @@
 import os
 import json
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import datetime
+import random
+import time
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 TABLE_NAME = os.environ.get("TABLE_NAME", "LoopMind")
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-2")
+LEARN_TXN_ATTEMPTS = 4
+
+_CFG = Config(tcp_keepalive=True, max_pool_connections=50, retries={"mode": "standard", "max_attempts": 3})
 
-ddb = boto3.resource("dynamodb", region_name=AWS_REGION)
+ddb = boto3.resource("dynamodb", region_name=AWS_REGION, config=_CFG)
 table = ddb.Table(TABLE_NAME)
 
 
+_ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
 def resp(code, body):
     return {
         "statusCode": code,
@@ -19,12 +34,49 @@ def resp(code, body):
             "Access-Control-Allow-Headers": "content-type",
             "Access-Control-Allow-Methods": "OPTIONS,POST",
         },
-        "body": json.dumps(body),
+        "body": (
+            orjson.dumps(body, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+            if orjson is not None else _ENCODER(body)
+        ),
     }
 
 
 def now_iso():
-    return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+
+
+def bump_topics_rev(pk):
+    """
+    Bump the user's META topics_rev so get_feed's cached topic list is refreshed.
+    Best effort: a missed bump only leaves that cache stale until its TTL runs out.
+    """
+    try:
+        table.update_item(
+            Key={"PK": pk, "SK": "META"},
+            UpdateExpression="ADD topics_rev :one",
+            ExpressionAttributeValues={":one": 1},
+        )
+    except Exception as e:
+        print(f"topics_rev bump failed for {pk}: {e}")
+
+
+def write_learn(txn_items):
+    """
+    Run the LEARN transaction (Put first); False if the record already existed.
+    Concurrent reads on one topic both update its TOPIC item and can cancel each other
+    with TransactionConflict, which botocore doesn't retry, so those retry with jitter.
+    """
+    for attempt in range(LEARN_TXN_ATTEMPTS):
+        try:
+            table.meta.client.transact_write_items(TransactItems=txn_items)
+            return True
+        except ClientError as e:
+            codes = [r.get("Code") for r in e.response.get("CancellationReasons") or []]
+            if codes and codes[0] == "ConditionalCheckFailed":
+                return False  # the Put's condition: already learnt
+            if "TransactionConflict" not in codes or attempt == LEARN_TXN_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
 
 
 def lambda_handler(event, context):
@@ -48,11 +100,12 @@ def lambda_handler(event, context):
         topic_sk = f"TOPIC#{node_id}"
         ts = now_iso()
 
-        # Idempotent write: only increments count if it's NEW
-        created = False
-        try:
-            table.put_item(
-                Item={
+        # Idempotent write: LEARN put + topic counter bump commit together, and only if the
+        # record is NEW (a failed condition cancels the whole transaction)
+        created = write_learn([
+            {"Put": {
+                "TableName": TABLE_NAME,
+                "Item": {
                     "PK": pk,
                     "SK": learn_sk,
                     "entity_type": "LearningRecord",
@@ -61,22 +114,17 @@ def lambda_handler(event, context):
                     "node_id": node_id,
                     "learnt_at": ts,
                 },
-                ConditionExpression="attribute_not_exists(PK) AND attribute_not_exists(SK)",
-            )
-            created = True
-        except Exception:
-            created = False  # already learnt
-
+                "ConditionExpression": "attribute_not_exists(PK) AND attribute_not_exists(SK)",
+            }},
+            {"Update": {
+                "TableName": TABLE_NAME,
+                "Key": {"PK": pk, "SK": topic_sk},
+                "UpdateExpression": "SET learnt_count = if_not_exists(learnt_count, :z) + :one, updated_at = :u",
+                "ExpressionAttributeValues": {":z": 0, ":one": 1, ":u": ts},
+            }},
+        ])
         if created:
-            # atomic increment
-            try:
-                table.update_item(
-                    Key={"PK": pk, "SK": topic_sk},
-                    UpdateExpression="SET learnt_count = if_not_exists(learnt_count, :z) + :one, updated_at = :u",
-                    ExpressionAttributeValues={":z": 0, ":one": 1, ":u": ts},
-                )
-            except Exception:
-                pass  # topic might not exist
+            bump_topics_rev(pk)  # learnt_count changed; kept out of the transaction on purpose
 
         return resp(200, {
             "alu_id": alu_id,
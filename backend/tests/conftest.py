@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+REGION = "us-east-2"
+BUCKET = "loopmind-test-images"
+
+# The handlers read their config and build their boto3 clients at import time
+os.environ.update({
+    "AWS_ACCESS_KEY_ID": "testing",
+    "AWS_SECRET_ACCESS_KEY": "testing",
+    "AWS_SESSION_TOKEN": "testing",
+    "AWS_REGION": REGION,
+    "AWS_DEFAULT_REGION": REGION,
+    "TABLE_NAME": "LoopMind",
+    "IMAGE_BUCKET": BUCKET,
+    "GEMINI_API_KEY": "test-key",
+})
+
+try:
+    # Imported before any handler module so its botocore hooks cover their clients too
+    import moto
+except ImportError:
+    moto = None
+
+
+@pytest.fixture
+def aws():
+    """
+    Fresh mocked table and bucket. The handler modules are imported once and reused.
+    """
+    if moto is None:
+        pytest.skip("moto not installed")
+    import boto3
+
+    with moto.mock_aws():
+        boto3.client("dynamodb", region_name=REGION).create_table(
+            TableName="LoopMind",
+            KeySchema=[{"AttributeName": "PK", "KeyType": "HASH"}, {"AttributeName": "SK", "KeyType": "RANGE"}],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        boto3.client("s3", region_name=REGION).create_bucket(
+            Bucket=BUCKET, CreateBucketConfiguration={"LocationConstraint": REGION}
+        )
+        yield
@@ -0,0 +1,125 @@
+import io
+import threading
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.response import StreamingBody  # noqa: E402
+from botocore.stub import Stubber  # noqa: E402
+
+import generate_alus  # noqa: E402
+
+
+@pytest.mark.parametrize("text", [
+    "make a poster", "make posters", "motivational quotes", "two banners",
+    "book covers", "an ad for shoes", "ads that convert", "title cards", "logos",
+])
+def test_wants_text_in_image_matches_keywords_and_plurals(text):
+    assert generate_alus.wants_text_in_image(text, "")
+
+
+@pytest.mark.parametrize("text", [
+    "head and shoulders", "read the chapter", "upload a file", "discovery of DNA",
+])
+def test_wants_text_in_image_ignores_embedded_words(text):
+    assert not generate_alus.wants_text_in_image(text, "")
+
+
+def _stub_bedrock(monkeypatch, caching):
+    monkeypatch.setattr(generate_alus, "MODEL_ID", "test-model")
+    monkeypatch.setattr(generate_alus, "_prompt_caching", caching)
+    monkeypatch.setattr(generate_alus, "_streaming", True)
+    sent = []
+    real = generate_alus._invoke_body
+
+    def record(payload):
+        sent.append(payload)
+        return real(payload)
+
+    monkeypatch.setattr(generate_alus, "_invoke_body", record)
+    return Stubber(generate_alus.brt), sent
+
+
+def _invoke_model_ok(st, text):
+    data = b'{"content":[{"type":"text","text":"%s"}],"stop_reason":"end_turn"}' % text.encode()
+    st.add_response(
+        "invoke_model",
+        {"body": StreamingBody(io.BytesIO(data), len(data)), "contentType": "application/json"},
+    )
+
+
+def test_rejected_cache_control_is_dropped_and_retried(monkeypatch):
+    st, sent = _stub_bedrock(monkeypatch, caching=True)
+    st.add_client_error("invoke_model_with_response_stream", "ValidationException")
+    st.add_client_error("invoke_model_with_response_stream", "AccessDeniedException")
+    _invoke_model_ok(st, "hi")
+
+    with st:
+        assert generate_alus.invoke_claude("prompt", cached_prefix="static header") == ("hi", "end_turn")
+        st.assert_no_pending_responses()
+
+    assert generate_alus._prompt_caching is False
+    assert len(sent) == 2
+    assert b"cache_control" in sent[0]
+    assert b"cache_control" not in sent[1]
+
+
+def test_validation_error_without_caching_is_not_retried(monkeypatch):
+    st, sent = _stub_bedrock(monkeypatch, caching=False)
+    st.add_client_error("invoke_model_with_response_stream", "ValidationException", "Input is too long")
+
+    with st, pytest.raises(RuntimeError):
+        generate_alus.invoke_claude("prompt", cached_prefix="static header")
+    st.assert_no_pending_responses()
+    assert len(sent) == 1
+    assert generate_alus._streaming is True
+
+
+def test_stream_access_denied_switches_to_invoke_model_for_good(monkeypatch):
+    st, _ = _stub_bedrock(monkeypatch, caching=False)
+    st.add_client_error("invoke_model_with_response_stream", "AccessDeniedException")
+    _invoke_model_ok(st, "one")
+    _invoke_model_ok(st, "two")
+
+    with st:
+        assert generate_alus.invoke_claude("prompt")[0] == "one"
+        assert generate_alus.invoke_claude("prompt")[0] == "two"
+        st.assert_no_pending_responses()
+    assert generate_alus._streaming is False
+
+
+def test_streaming_validation_error_falls_back(monkeypatch):
+    st, _ = _stub_bedrock(monkeypatch, caching=False)
+    st.add_client_error(
+        "invoke_model_with_response_stream", "ValidationException", "The model is unsupported for streaming"
+    )
+    _invoke_model_ok(st, "hi")
+
+    with st:
+        assert generate_alus.invoke_claude("prompt") == ("hi", "end_turn")
+        st.assert_no_pending_responses()
+    assert generate_alus._streaming is False
+
+
+def test_parse_json_race_leaves_the_shared_pool_free(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def complete(prompt, max_tokens=3000, temperature=0.35, cached_prefix=None):
+        if prompt.startswith("Fix the following"):
+            started.wait(5)  # win only once the fresh run is running (and can't be cancelled)
+            return '[{"title": "ok"}]'
+        started.set()
+        release.wait(10)
+        return "[]"
+
+    monkeypatch.setattr(generate_alus, "invoke_claude_complete", complete)
+    try:
+        assert generate_alus.parse_json("not json", retry_prompt="original") == [{"title": "ok"}]
+
+        n = generate_alus._POOL._max_workers
+        barrier = threading.Barrier(n)
+        futures = [generate_alus._POOL.submit(barrier.wait, 5) for _ in range(n)]
+        for f in futures:
+            f.result(timeout=10)  # BrokenBarrierError if a worker were still held
+    finally:
+        release.set()
@@ -0,0 +1,82 @@
+import base64
+import json
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+
+import generate_alus as ga  # noqa: E402
+import generate_image as gi  # noqa: E402
+
+
+def _cards():
+    return [
+        {
+            "title": "Mitochondria",
+            "hook": "Mitochondria power the cell",
+            "post_type": "image",
+            "micro_explanation": ["They make ATP."],
+            "image_style": "cinematic",
+            "image_labels": ["ATP"],
+            "image_prompt": "SUBJECT: a glowing mitochondrion inside a cell",
+            "takeaways": ["ATP comes from mitochondria"],
+            "mastery_question": "What do mitochondria make?",
+        },
+        {
+            "title": "ATP",
+            "hook": "What is ATP?",
+            "post_type": "flashcard",
+            "micro_explanation": ["Energy currency."],
+            "flashcard": {"What is ATP?": "The cell's energy currency."},
+        },
+        {
+            "title": "Quiz",
+            "hook": "Check yourself",
+            "post_type": "quiz",
+            "micro_explanation": ["Review."],
+            "quiz": {"question": "Q?", "choices": ["a", "b", "c", "d"], "answer_index": 0, "explanation": "e"},
+        },
+    ]
+
+
+def test_stamp_accepts_generate_alus_null_placeholder(aws, monkeypatch):
+    user_id, node_id = "u1", "n1"
+
+    items, image_jobs = ga.finalize_cards(_cards(), False, user_id, node_id, ga.now_iso())
+    assert len(image_jobs) == 1
+    assert any("image_s3_key" in it and it["image_s3_key"] is None for it in items)
+
+    for f in ga.write_items_async(items):
+        f.result()
+    gi.table.put_item(Item={
+        "PK": f"USER#{user_id}",
+        "SK": f"TOPIC#{node_id}",
+        "status": "images_pending",
+        "pending_images": len(image_jobs),
+    })
+
+    png = b"\x89PNG\r\n\x1a\nfake"
+    monkeypatch.setattr(gi, "call_gemini_image", lambda prompt: {
+        "candidates": [{"content": {"parts": [{"inlineData": {"data": base64.b64encode(png).decode()}}]}}],
+    })
+
+    job = image_jobs[0]
+    r = gi.lambda_handler(dict(job), None)
+    assert r["statusCode"] == 200
+    assert json.loads(r["body"])["topic_ready"] is True
+
+    pk = f"USER#{user_id}"
+    alu = gi.table.get_item(Key={"PK": pk, "SK": f"ALU#{node_id}#{job['alu_id']}"})["Item"]
+    key = alu["image_s3_key"]
+    assert key == f"users/{user_id}/{node_id}/{job['alu_id']}.png"
+    assert boto3.client("s3", region_name=gi.AWS_REGION).get_object(Bucket=gi.BUCKET, Key=key)["Body"].read() == png
+
+    topic = gi.table.get_item(Key={"PK": pk, "SK": f"TOPIC#{node_id}"})["Item"]
+    assert topic["status"] == "ready"
+    assert topic["pending_images"] == 0
+
+    # A duplicate invocation must not count the topic down again
+    r = gi.lambda_handler(dict(job), None)
+    assert json.loads(r["body"])["reason"] == "already has image"
+    topic = gi.table.get_item(Key={"PK": pk, "SK": f"TOPIC#{node_id}"})["Item"]
+    assert topic["pending_images"] == 0
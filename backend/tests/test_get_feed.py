@@ -0,0 +1,176 @@
+import base64
+import datetime
+import json
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+import botocore.auth  # noqa: E402
+from botocore.config import Config  # noqa: E402
+
+import generate_alus  # noqa: E402
+import generate_image  # noqa: E402
+import get_feed  # noqa: E402
+import make_read  # noqa: E402
+import topic_deletion  # noqa: E402
+
+
+def _mode2(user_id="u1", node_id="n1"):
+    return {"queryStringParameters": {"user_id": user_id, "node_id": node_id}}
+
+
+def test_pool_workers_each_get_their_own_table():
+    n = get_feed._POOL._max_workers
+    barrier = threading.Barrier(n)
+
+    def grab():
+        barrier.wait(timeout=5)  # hold every worker, so n distinct threads answer
+        return get_feed._table()
+
+    tables = [f.result() for f in [get_feed._POOL.submit(grab) for _ in range(n)]]
+    clients = {id(t.meta.client) for t in tables}
+    assert len(clients) == n
+    assert id(get_feed.table.meta.client) not in clients
+
+
+def test_mode2_reads_run_in_parallel_without_mixing_key_conditions(aws):
+    pk = "USER#u1"
+    get_feed.table.put_item(Item={"PK": pk, "SK": "TOPIC#n1", "title": "Cells", "status": "ready", "card_count": 5})
+    with get_feed.table.batch_writer() as bw:
+        for i in range(5):
+            bw.put_item(Item={"PK": pk, "SK": f"ALU#n1#a{i}", "alu_id": f"a{i}", "node_id": "n1", "order": 5 - i})
+            bw.put_item(Item={"PK": pk, "SK": f"ALU#n2#b{i}", "alu_id": f"b{i}", "node_id": "n2", "order": i})
+        for node_id, alu_id in (("n1", "a1"), ("n1", "a3"), ("n2", "b2")):
+            bw.put_item(Item={"PK": pk, "SK": f"LEARN#{node_id}#{alu_id}", "alu_id": alu_id})
+
+    # Several MODE 2 requests at once keep more queries in flight on the pool
+    with get_feed.ThreadPoolExecutor(max_workers=4) as ex:
+        results = list(ex.map(get_feed.lambda_handler, [_mode2()] * 8, [None] * 8))
+
+    for r in results:
+        assert r["statusCode"] == 200, r["body"]
+        body = json.loads(r["body"])
+        assert body["topic"]["title"] == "Cells"
+        assert [c["alu_id"] for c in body["cards"]] == ["a4", "a3", "a2", "a1", "a0"]
+        assert {c["alu_id"] for c in body["cards"] if c["is_learnt"]} == {"a1", "a3"}
+
+
+PRESIGN_KEYS = [
+    "users/u1/n1/a1.png",
+    "users/ü ser/n1/résumé 1.png",
+    "users/u1/n1/a+b=c&d~e!*'();:@$,?#[].png",
+]
+
+
+def _s3v4(addressing_style):
+    return boto3.client(
+        "s3",
+        region_name=get_feed.AWS_REGION,
+        config=Config(signature_version="s3v4", s3={"addressing_style": addressing_style}),
+    )
+
+
+def _split(url):
+    u = urlsplit(url)
+    return u.netloc, u.path, parse_qs(u.query, keep_blank_values=True)
+
+
+@pytest.mark.parametrize("bucket, addressing_style", [
+    ("loopmind-test-images", "virtual"),
+    ("loopmind.test.images", "path"),
+])
+def test_presign_many_matches_botocore(monkeypatch, bucket, addressing_style):
+    t = 1790000000
+    frozen = datetime.datetime.fromtimestamp(t, datetime.timezone.utc).replace(tzinfo=None)
+    monkeypatch.setattr(botocore.auth, "get_current_datetime", lambda *a, **k: frozen)
+    if "." in bucket:
+        monkeypatch.setattr(get_feed, "_S3_HOST", f"s3.{get_feed.AWS_REGION}.amazonaws.com")
+        monkeypatch.setattr(get_feed, "_S3_PATH", f"/{bucket}")
+    else:
+        monkeypatch.setattr(get_feed, "_S3_HOST", f"{bucket}.s3.{get_feed.AWS_REGION}.amazonaws.com")
+        monkeypatch.setattr(get_feed, "_S3_PATH", "")
+
+    s3 = _s3v4(addressing_style)
+    ours = get_feed.presign_many(PRESIGN_KEYS, now=t)
+    assert get_feed._credentials().token  # the session-token parameter is covered too
+
+    for key in PRESIGN_KEYS:
+        expected = s3.generate_presigned_url(
+            "get_object", Params={"Bucket": bucket, "Key": key}, ExpiresIn=get_feed.URL_TTL
+        )
+        assert _split(ours[key]) == _split(expected)
+
+
+CARDS = [
+    {"title": "Mitochondria", "hook": "They power the cell", "post_type": "image", "image_style": "cinematic"},
+    {"title": "ATP", "hook": "Energy currency", "post_type": "flashcard", "flashcard": {"front": "ATP?", "back": "Energy."}},
+    {"title": "Check", "hook": "Quick check", "post_type": "quiz",
+     "quiz": {"question": "Q?", "choices": ["a", "b", "c", "d"], "answer_index": 0, "explanation": "e"}},
+]
+
+
+def _mode1(etag=None):
+    event = {"queryStringParameters": {"user_id": "u1"}}
+    if etag:
+        event["headers"] = {"If-None-Match": etag}
+    return event
+
+
+def test_topic_list_cache_follows_every_topic_writer(aws, monkeypatch):
+    monkeypatch.setattr(get_feed, "_TOPIC_CACHE", {})
+    queries = []
+    real_query_all = get_feed.query_all
+    monkeypatch.setattr(get_feed, "query_all", lambda **kw: queries.append(kw) or real_query_all(**kw))
+
+    def topics(etag=None):
+        r = get_feed.lambda_handler(_mode1(etag), None)
+        return r, (json.loads(r["body"])["topics"] if r["statusCode"] == 200 else None)
+
+    r, listed = topics()
+    assert listed == [] and len(queries) == 1
+    r, listed = topics()
+    assert listed == [] and len(queries) == 1  # served from the cache
+
+    # generate_alus: new topic, waiting on its image
+    jobs = []
+    monkeypatch.setattr(generate_alus, "pass1_extract_concepts", lambda raw_text, target_n: [{"title": "Cells"}])
+    monkeypatch.setattr(generate_alus, "pass2_design_cards", lambda *a, **k: [dict(c) for c in CARDS])
+    monkeypatch.setattr(generate_alus, "invoke_images_async", jobs.extend)
+    r = generate_alus.lambda_handler({"body": json.dumps({"user_id": "u1", "title": "Cells", "raw_text": "Cells"})}, None)
+    assert r["statusCode"] == 200, r["body"]
+    node_id = json.loads(r["body"])["node_id"]
+
+    r, listed = topics()
+    assert [(t["node_id"], t["status"]) for t in listed] == [(node_id, "images_pending")]
+
+    # generate_image: the last image flips the topic to ready
+    png = base64.b64encode(b"\x89PNG fake").decode()
+    monkeypatch.setattr(generate_image, "call_gemini_image", lambda prompt: {
+        "candidates": [{"content": {"parts": [{"inlineData": {"data": png}}]}}],
+    })
+    assert len(jobs) == 1
+    assert generate_image.lambda_handler(dict(jobs[0]), None)["statusCode"] == 200
+    r, listed = topics()
+    assert listed[0]["status"] == "ready"
+
+    # make_read: learnt_count shows up without waiting for the TTL
+    alu_id = jobs[0]["alu_id"]
+    r = make_read.lambda_handler({"body": json.dumps({"user_id": "u1", "alu_id": alu_id, "node_id": node_id})}, None)
+    assert json.loads(r["body"])["created"] is True
+    r, listed = topics()
+    assert listed[0]["learnt_count"] == 1
+
+    # Unchanged list: a matching If-None-Match gets a bodyless 304
+    etag = r["headers"]["ETag"]
+    n = len(queries)
+    r, _ = topics(etag)
+    assert r["statusCode"] == 304 and r["body"] == ""
+    assert len(queries) == n
+
+    # topic_deletion: the topic is gone from the next list
+    r = topic_deletion.lambda_handler({"body": json.dumps({"user_id": "u1", "node_id": node_id})}, None)
+    assert r["statusCode"] == 200
+    r, listed = topics(etag)
+    assert r["statusCode"] == 200 and listed == []
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+pytest.importorskip("boto3")
+from botocore.stub import ANY, Stubber  # noqa: E402
+
+
+@pytest.fixture
+def mr(monkeypatch):
+    import make_read
+    monkeypatch.setattr(make_read.time, "sleep", lambda s: None)
+    with Stubber(make_read.table.meta.client) as st:
+        yield make_read, st
+        st.assert_no_pending_responses()
+
+
+def _event():
+    return {"body": json.dumps({"user_id": "u1", "alu_id": "a1", "node_id": "n1"})}
+
+
+def _cancel(st, *codes):
+    st.add_client_error(
+        "transact_write_items",
+        service_error_code="TransactionCanceledException",
+        modeled_fields={"CancellationReasons": [{"Code": c} for c in codes]},
+    )
+
+
+def _meta_bump(st):
+    # Outside the transaction: a per-user META item in it would conflict across topics
+    st.add_response("update_item", {}, {
+        "TableName": ANY,
+        "Key": {"PK": "USER#u1", "SK": "META"},
+        "UpdateExpression": "ADD topics_rev :one",
+        "ExpressionAttributeValues": ANY,
+    })
+
+
+def test_new_record(mr):
+    m, st = mr
+    st.add_response("transact_write_items", {})
+    _meta_bump(st)
+    r = m.lambda_handler(_event(), None)
+    assert r["statusCode"] == 200
+    assert json.loads(r["body"])["created"] is True
+
+
+def test_already_learnt(mr):
+    m, st = mr
+    _cancel(st, "ConditionalCheckFailed", "None")
+    r = m.lambda_handler(_event(), None)
+    assert r["statusCode"] == 200
+    assert json.loads(r["body"])["created"] is False
+
+
+def test_conflict_is_retried(mr):
+    m, st = mr
+    _cancel(st, "None", "TransactionConflict")
+    _cancel(st, "None", "TransactionConflict")
+    st.add_response("transact_write_items", {})
+    _meta_bump(st)
+    r = m.lambda_handler(_event(), None)
+    assert r["statusCode"] == 200
+    assert json.loads(r["body"])["created"] is True
+
+
+def test_conflict_gives_up_after_attempts(mr):
+    m, st = mr
+    for _ in range(m.LEARN_TXN_ATTEMPTS):
+        _cancel(st, "None", "TransactionConflict")
+    assert m.lambda_handler(_event(), None)["statusCode"] == 500
+
+
+def test_other_cancellation_is_not_already_learnt(mr):
+    m, st = mr
+    _cancel(st, "None", "ValidationError")
+    assert m.lambda_handler(_event(), None)["statusCode"] == 500
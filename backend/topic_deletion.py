@@ -1,13 +1,26 @@
 import os
 import json
 import boto3
+from botocore.config import Config
 from boto3.dynamodb.conditions import Key
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 TABLE_NAME = os.environ.get("TABLE_NAME", "LoopMind")
-ddb = boto3.resource("dynamodb")
+AWS_REGION = os.environ.get("AWS_REGION", "us-east-2")
+
+_CFG = Config(tcp_keepalive=True, max_pool_connections=50, retries={"mode": "standard", "max_attempts": 3})
+
+ddb = boto3.resource("dynamodb", region_name=AWS_REGION, config=_CFG)
 table = ddb.Table(TABLE_NAME)
 
 
+_ENCODER = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
 def resp(code, body):
     return {
         "statusCode": code,
@@ -17,10 +30,40 @@ def resp(code, body):
             "Access-Control-Allow-Headers": "content-type",
             "Access-Control-Allow-Methods": "OPTIONS,POST,DELETE",
         },
-        "body": json.dumps(body),
+        "body": (
+            orjson.dumps(body, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+            if orjson is not None else _ENCODER(body)
+        ),
     }
 
 
+def query_all(**kwargs):
+    """
+    table.query that follows LastEvaluatedKey, yielding items page by page.
+    """
+    while True:
+        r = table.query(**kwargs)
+        yield from r.get("Items", [])
+        if "LastEvaluatedKey" not in r:
+            return
+        kwargs["ExclusiveStartKey"] = r["LastEvaluatedKey"]
+
+
+def bump_topics_rev(pk):
+    """
+    Bump the user's META topics_rev so get_feed's cached topic list is refreshed.
+    Best effort: a missed bump only leaves that cache stale until its TTL runs out.
+    """
+    try:
+        table.update_item(
+            Key={"PK": pk, "SK": "META"},
+            UpdateExpression="ADD topics_rev :one",
+            ExpressionAttributeValues={":one": 1},
+        )
+    except Exception as e:
+        print(f"topics_rev bump failed for {pk}: {e}")
+
+
 def lambda_handler(event, context):
     if event.get("requestContext", {}).get("http", {}).get("method") == "OPTIONS":
         return resp(200, {"ok": True})
@@ -36,29 +79,19 @@ def lambda_handler(event, context):
         if not user_id or not node_id:
             return resp(400, {"error": "user_id and node_id required"})
 
-        # 1. Delete Topic record
-        table.delete_item(Key={"PK": f"USER#{user_id}", "SK": f"TOPIC#{node_id}"})
+        pk = f"USER#{user_id}"
 
-        # 2. Delete all ALU cards for this topic
-        alus = table.query(
-            KeyConditionExpression=(
-                Key("PK").eq(f"USER#{user_id}")
-                & Key("SK").begins_with(f"ALU#{node_id}#")
-            ),
-        )
-        for item in alus.get("Items", []):
-            table.delete_item(Key={"PK": item["PK"], "SK": item["SK"]})
-
-        # 3. Delete all LEARN records for this topic
-        learns = table.query(
-            KeyConditionExpression=(
-                Key("PK").eq(f"USER#{user_id}")
-                & Key("SK").begins_with("LEARN#")
-            ),
-        )
-        for item in learns.get("Items", []):
-            if item.get("node_id") == node_id:
-                table.delete_item(Key={"PK": item["PK"], "SK": item["SK"]})
+        # Delete topic + cards + learns: one BatchWriteItem per 25 keys, batch_writer
+        # re-sends unprocessed items. Keys stream in page by page.
+        with table.batch_writer() as bw:
+            bw.delete_item(Key={"PK": pk, "SK": f"TOPIC#{node_id}"})
+            for prefix in (f"ALU#{node_id}#", f"LEARN#{node_id}#"):
+                for item in query_all(
+                    KeyConditionExpression=Key("PK").eq(pk) & Key("SK").begins_with(prefix),
+                    ProjectionExpression="PK, SK",
+                ):
+                    bw.delete_item(Key={"PK": item["PK"], "SK": item["SK"]})
+        bump_topics_rev(pk)
 
         return resp(200, {
             "status": "deleted",